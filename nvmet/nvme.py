@@ -20,11 +20,16 @@ under the License.
 
 import os
 import stat
+import errno
 import uuid
-import json
-from glob import iglob as glob
+
+try:
+    from os import scandir
+except ImportError:
+    scandir = None
 
 DEFAULT_SAVE_FILE = '/etc/nvmet/config.json'
+GENERATED_NQN_PREFIX = 'nqn.2014-08.org.nvmexpress:NVMf:uuid:'
 
 
 class CFSError(Exception):
@@ -44,13 +49,90 @@ class CFSNotFound(CFSError):
     pass
 
 
+# Marks an enable state that has not been read from configFS yet.
+_UNREAD = object()
+
+
+def _open_attr(path, flags, dir_fd=None):
+    try:
+        if dir_fd is None:
+            return os.open(path, flags)
+        return os.open(path, flags, dir_fd=dir_fd)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            raise CFSError("Cannot find attribute: %s" % path)
+        raise
+
+
+def _read_attr(path, dir_fd=None):
+    '''
+    Reads a configfs attribute file.  Attribute values never exceed a
+    page, so a single read() returns all of it.  The file is opened for
+    each read on purpose: configfs fills its read buffer once per open,
+    so pread() on a cached descriptor would keep returning the value
+    from the first read.
+    '''
+    fd = _open_attr(path, os.O_RDONLY, dir_fd)
+    try:
+        value = os.read(fd, 4096)
+    finally:
+        os.close(fd)
+    # os.read() returns bytes, which is already str on Python 2
+    if not isinstance(value, str):
+        value = value.decode()
+    return value.strip()
+
+
+def _write_attr(path, value, dir_fd=None):
+    try:
+        fd = _open_attr(path, os.O_WRONLY | os.O_TRUNC, dir_fd)
+    except OSError as e:
+        raise CFSError("Cannot set attribute %s: %s" % (path, e))
+    try:
+        value = str(value)
+        # str is already bytes on Python 2, write it unchanged
+        if not isinstance(value, bytes):
+            value = value.encode()
+        os.write(fd, value)
+    except (OSError, UnicodeError) as e:
+        raise CFSError("Cannot set attribute %s: %s" % (path, e))
+    finally:
+        os.close(fd)
+
+
+def _write_attrs(items, err_func):
+    '''
+    Writes a batch of configfs attribute files.  Errors do not stop the
+    batch, each one is reported through I{err_func} instead.
+    @param items: (path, value) tuples.
+    '''
+    for path, value in items:
+        try:
+            _write_attr(path, value)
+        except CFSError as e:
+            err_func(str(e))
+
+
+def _list_paths(dirname):
+    return [dirname + "/" + name for name in os.listdir(dirname)]
+
+
 class CFSNode(object):
 
+    # One instance is created per configFS node that is looked up, so
+    # keep them free of a per-instance __dict__.
+    __slots__ = ('_path', '_path_prefix', '_enable_cache', 'attr_groups')
+
     configfs_dir = '/sys/kernel/config/nvmet'
 
+    # Attribute file modes keyed by class, then by file name.  The
+    # attribute files of a node are fixed by its configFS item type, so
+    # the first node of a class to list them does so for all others.
+    _attr_modes_by_class = {}
+
     def __init__(self):
         self._path = self.configfs_dir
-        self._enable = None
+        self._enable_cache = _UNREAD
         self.attr_groups = []
 
     def __eq__(self, other):
@@ -68,24 +150,29 @@ class CFSNode(object):
         the mode.
         any -> makes sure it exists, also works if the node already does exist
         lookup -> make sure it does NOT exist
+        lookup_unchecked -> like lookup, but the caller already knows that
+            the node exists, e.g. because it was just listed
         create -> create the node which must not exist beforehand
         '''
-        if mode not in ['any', 'lookup', 'create']:
+        if mode not in ['any', 'lookup', 'lookup_unchecked', 'create']:
             raise CFSError("Invalid mode: %s" % mode)
-        if self.exists and mode == 'create':
+        self._path_prefix = self._path + "/"
+        if mode == 'lookup_unchecked':
+            return
+        exists = self.exists
+        if exists and mode == 'create':
             raise CFSError("This %s already exists in configFS" %
                            self.__class__.__name__)
-        elif not self.exists and mode == 'lookup':
+        elif not exists and mode == 'lookup':
             raise CFSNotFound("No such %s in configfs: %s" %
                               (self.__class__.__name__, self.path))
 
-        if not self.exists:
+        if not exists:
             try:
                 os.mkdir(self.path)
             except:
                 raise CFSError("Could not create %s in configFS" %
                                self.__class__.__name__)
-        self.get_enable()
 
     def _exists(self):
         return os.path.isdir(self.path)
@@ -106,23 +193,39 @@ class CFSNode(object):
         '''
         self._check_self()
 
-        names = [os.path.basename(name).split('_', 1)[1]
-                 for name in glob("%s/%s_*" % (self._path, group))
-                     if os.path.isfile(name)]
-
-        if writable is True:
-            names = [name for name in names
-                     if self._attr_is_writable(group, name)]
-        elif writable is False:
-            names = [name for name in names
-                     if not self._attr_is_writable(group, name)]
+        prefix = group + "_"
+        plen = len(prefix)
+        names = [name[plen:] for name, mode in self._attr_modes().items()
+                 if name.startswith(prefix) and
+                 (writable is None or bool(mode & stat.S_IWUSR) == writable)]
 
         names.sort()
         return names
 
-    def _attr_is_writable(self, group, name):
-        s = os.stat("%s/%s_%s" % (self._path, group, name))
-        return s[stat.ST_MODE] & stat.S_IWUSR
+    def _attr_modes(self):
+        '''
+        Returns the mode of every attribute file, keyed by file name.  The
+        first node of each class reads them with a single scandir() pass
+        over its directory, or listdir() and lstat() where os.scandir() is
+        not available.  Attribute files added to configFS later, e.g. by
+        loading a newer nvmet module, are not picked up.
+        '''
+        cls = self.__class__
+        modes = self._attr_modes_by_class.get(cls)
+        if modes is None:
+            if scandir is not None:
+                modes = dict(
+                    (entry.name, entry.stat(follow_symlinks=False).st_mode)
+                    for entry in scandir(self._path)
+                        if entry.is_file(follow_symlinks=False))
+            else:
+                modes = {}
+                for name in os.listdir(self._path):
+                    mode = os.lstat(self._path_prefix + name).st_mode
+                    if stat.S_ISREG(mode):
+                        modes[name] = mode
+            self._attr_modes_by_class[cls] = modes
+        return modes
 
     def set_attr(self, group, attribute, value):
         '''
@@ -133,21 +236,77 @@ class CFSNode(object):
         @param value: The attribute's value.
         @type value: string
         '''
-        self._check_self()
-        path = "%s/%s_%s" % (self.path, str(group), str(attribute))
+        path = self._path_prefix + group + "_" + attribute
 
-        if not os.path.isfile(path):
-            raise CFSError("Cannot find attribute: %s" % path)
+        if self._enable:
+            raise CFSError("Cannot set attribute while %s is enabled" %
+                           self.__class__.__name__)
+
+        try:
+            _write_attr(path, value)
+        except CFSError:
+            self._check_self()
+            raise
 
+    def apply_attrs(self, groups):
+        '''
+        Sets several named attributes at once.
+        The attributes must exist in configFS.  Stops at the first
+        attribute that cannot be set.
+        @param groups: The attribute values keyed by group and then by
+        attribute name, as in the output of dump().
+        @type groups: dict
+        '''
         if self._enable:
             raise CFSError("Cannot set attribute while %s is enabled" %
                            self.__class__.__name__)
 
+        items = [(group + "_" + name, value)
+                 for group, attrs in groups.items()
+                 for name, value in attrs.items()]
+        self._attr_batch(_write_attr, items)
+
+    def get_attrs(self, group):
+        '''
+        Gets the values of all attributes of a group.
+        @param group: The attribute group
+        @return: A dict of the attribute values as strings, keyed by the
+        attributes' names.
+        '''
+        names = self.list_attrs(group)
+        values = self._attr_batch(_read_attr,
+                                  [(group + "_" + name,) for name in names])
+        return dict(zip(names, values))
+
+    def _attr_batch(self, func, items):
+        '''
+        Calls I{func} for each attribute file in turn, stopping at the first
+        CFSError.  When os.open() supports dir_fd, the node directory is
+        opened once and the files are opened relative to it.
+        @param func: _read_attr or _write_attr.
+        @param items: Tuples of an attribute file name and the arguments to
+        pass to I{func} after the path.
+        @return: A list of the results of I{func}.
+        '''
         try:
-            with open(path, 'w') as file_fd:
-                file_fd.write(str(value))
-        except Exception as e:
-            raise CFSError("Cannot set attribute %s: %s" % (path, e))
+            if os.open not in getattr(os, 'supports_dir_fd', ()):
+                return [func(self._path_prefix + item[0], *item[1:])
+                        for item in items]
+
+            try:
+                dir_fd = os.open(self._path, os.O_RDONLY | os.O_DIRECTORY)
+            except OSError as e:
+                raise CFSError("Cannot open %s: %s" % (self.path, e))
+            try:
+                return [func(item[0], *item[1:], dir_fd=dir_fd)
+                        for item in items]
+            except CFSError as e:
+                raise CFSError("%s: %s" % (self.path, e))
+            finally:
+                os.close(dir_fd)
+        except CFSError:
+            self._check_self()
+            raise
 
     def get_attr(self, group, attribute):
         '''
@@ -156,38 +315,51 @@ class CFSNode(object):
         @param attribute: The attribute's name.
         @return: The named attribute's value, as a string.
         '''
-        self._check_self()
-        path = "%s/%s_%s" % (self.path, str(group), str(attribute))
-        if not os.path.isfile(path):
-            raise CFSError("Cannot find attribute: %s" % path)
-
-        with open(path, 'r') as file_fd:
-            return file_fd.read().strip()
+        try:
+            return _read_attr(self._path_prefix + group + "_" + attribute)
+        except CFSError:
+            self._check_self()
+            raise
 
-    def get_enable(self):
+    def get_enable(self, use_cache=False):
+        '''
+        @param use_cache: If True, returns the enable state as last read or
+        written by this object instead of reading it from configFS again.
+        @return: The enable state as an int, None if the node cannot be
+        enabled.
+        '''
+        if use_cache and self._enable_cache is not _UNREAD:
+            return self._enable_cache
         self._check_self()
-        path = "%s/enable" % self.path
-        if not os.path.isfile(path):
-            return None
-
-        with open(path, 'r') as file_fd:
-            self._enable = int(file_fd.read().strip())
-        return self._enable
+        path = self._path_prefix + "enable"
+        try:
+            self._enable_cache = int(_read_attr(path))
+        except CFSError:
+            self._enable_cache = None
+        return self._enable_cache
 
     def set_enable(self, value):
         self._check_self()
-        path = "%s/enable" % self.path
+        path = self._path_prefix + "enable"
 
-        if not os.path.isfile(path) or self._enable is None:
+        if self._enable is None:
             raise CFSError("Cannot enable %s" % self.path)
 
         try:
-            with open(path, 'w') as file_fd:
-                file_fd.write(str(value))
-        except Exception as e:
+            _write_attr(path, value)
+        except CFSError as e:
             raise CFSError("Cannot enable %s: %s (%s)" %
                            (self.path, e, value))
-        self._enable = value
+        self._enable_cache = value
+
+    def _get_enable_cache(self):
+        if self._enable_cache is _UNREAD:
+            self.get_enable()
+        return self._enable_cache
+
+    _enable = property(_get_enable_cache,
+            doc="The enable state as last read or written, None if the "
+                + "node cannot be enabled.  Read from configFS on first use.")
 
     def delete(self):
         '''
@@ -197,6 +369,7 @@ class CFSNode(object):
         '''
         if self.exists:
             os.rmdir(self.path)
+        self._enable_cache = _UNREAD
 
     path = property(_get_path,
                     doc="Get the configFS object path.")
@@ -211,25 +384,30 @@ class CFSNode(object):
         for group in self.attr_groups:
             a = {}
             for i in self.list_attrs(group, writable=True):
-                a[str(i)] = self.get_attr(group, i)
-            d[str(group)] = a
+                a[i] = self.get_attr(group, i)
+            d[group] = a
         if self._enable is not None:
             d['enable'] = self._enable
         return d
 
     def _setup_attrs(self, attr_dict, err_func):
-        for group in self.attr_groups:
-            for name, value in attr_dict.get(group, {}).iteritems():
-                try:
-                    self.set_attr(group, name, value)
-                except CFSError as e:
-                    err_func(str(e))
+        items = [(self._path_prefix + group + "_" + name, value)
+                 for group in self.attr_groups
+                 for name, value in attr_dict.get(group, {}).items()]
+        if items:
+            if self._enable:
+                err_func("Cannot set attributes while %s is enabled" %
+                         self.__class__.__name__)
+            else:
+                _write_attrs(items, err_func)
         enable = attr_dict.get('enable')
         if enable is not None:
             self.set_enable(enable)
 
 
 class Root(CFSNode):
+    __slots__ = ('_subsystems_dir', '_ports_dir', '_hosts_dir')
+
     def __init__(self):
         super(Root, self).__init__()
 
@@ -241,6 +419,9 @@ class Root(CFSNode):
                            self.configfs_dir)
 
         self._path = self.configfs_dir
+        self._subsystems_dir = self._path + "/subsystems"
+        self._ports_dir = self._path + "/ports"
+        self._hosts_dir = self._path + "/hosts"
         self._create_in_cfs('lookup')
 
     def _modprobe(self, modname):
@@ -254,29 +435,44 @@ class Root(CFSNode):
         except ImportError:
             pass
 
-    def _list_subsystems(self):
+    def _list_subsystem_nqns(self):
         self._check_self()
+        return os.listdir(self._subsystems_dir)
+
+    subsystem_nqns = property(_list_subsystem_nqns,
+                              doc="Get the list of Subsystem NQNs.")
 
-        for d in os.listdir("%s/subsystems/" % self._path):
-            yield Subsystem(d, 'lookup')
+    def _list_subsystems(self):
+        for nqn in self.subsystem_nqns:
+            yield Subsystem(nqn, 'lookup_unchecked')
 
     subsystems = property(_list_subsystems,
                           doc="Get the list of Subsystems.")
 
-    def _list_ports(self):
+    def _list_portids(self):
         self._check_self()
+        return [int(d) for d in os.listdir(self._ports_dir)]
+
+    portids = property(_list_portids,
+                       doc="Get the list of Port IDs.")
 
-        for d in os.listdir("%s/ports/" % self._path):
-            yield Port(d, 'lookup')
+    def _list_ports(self):
+        for portid in self.portids:
+            yield Port(portid, 'lookup_unchecked')
 
     ports = property(_list_ports,
                 doc="Get the list of Ports.")
 
-    def _list_hosts(self):
+    def _list_host_nqns(self):
         self._check_self()
+        return os.listdir(self._hosts_dir)
+
+    host_nqns = property(_list_host_nqns,
+                         doc="Get the list of Host NQNs.")
 
-        for h in os.listdir("%s/hosts/" % self._path):
-            yield Host(h, 'lookup')
+    def _list_hosts(self):
+        for nqn in self.host_nqns:
+            yield Host(nqn, 'lookup_unchecked')
 
     hosts = property(_list_hosts,
                      doc="Get the list of Hosts.")
@@ -285,6 +481,8 @@ class Root(CFSNode):
         '''
         Write the configuration in json format to a file.
         '''
+        import json
+
         if savefile:
             savefile = os.path.expanduser(savefile)
         else:
@@ -295,13 +493,14 @@ class Root(CFSNode):
         if not os.path.exists(savefile_dir):
             os.makedirs(savefile_dir)
 
+        config = self.dump()
+
         with open(savefile + ".temp", "w+") as f:
             os.fchmod(f.fileno(), stat.S_IRUSR | stat.S_IWUSR)
-            f.write(json.dumps(self.dump(), sort_keys=True, indent=2))
+            json.dump(config, f, sort_keys=True, indent=2)
             f.write("\n")
             f.flush()
             os.fsync(f.fileno())
-            f.close()
 
         os.rename(savefile + ".temp", savefile)
 
@@ -310,12 +509,28 @@ class Root(CFSNode):
         Remove entire current configuration.
         '''
 
-        for p in self.ports:
-            p.delete()
-        for s in self.subsystems:
-            s.delete()
-        for h in self.hosts:
-            h.delete()
+        self._fast_clear()
+
+    def _fast_clear(self):
+        '''
+        Tears down the configFS tree bottom-up straight from the directory
+        listings, without building Port, Subsystem or Host objects for the
+        children that are removed.
+        '''
+        for p in _list_paths(self._ports_dir):
+            for s in _list_paths(p + "/subsystems"):
+                os.unlink(s)
+            for r in _list_paths(p + "/referrals"):
+                os.rmdir(r)
+            os.rmdir(p)
+        for s in _list_paths(self._subsystems_dir):
+            for ns in _list_paths(s + "/namespaces"):
+                os.rmdir(ns)
+            for h in _list_paths(s + "/allowed_hosts"):
+                os.unlink(h)
+            os.rmdir(s)
+        for h in _list_paths(self._hosts_dir):
+            os.rmdir(h)
 
     def restore(self, config, clear_existing=False, abort_on_error=False):
         '''
@@ -327,7 +542,7 @@ class Root(CFSNode):
         if clear_existing:
             self.clear_existing()
         else:
-            if any(self.subsystems):
+            if self.subsystem_nqns:
                 raise CFSError("subsystems present, not restoring")
 
         errors = []
@@ -341,25 +556,13 @@ class Root(CFSNode):
 
         # Create the hosts first because the subsystems reference them
         for index, t in enumerate(config.get('hosts', [])):
-            if 'nqn' not in t:
-                err_func("'nqn' not defined in host %d" % index)
-                continue
-
-            Host.setup(t, err_func)
+            Host.setup(t, err_func, index)
 
         for index, t in enumerate(config.get('subsystems', [])):
-            if 'nqn' not in t:
-                err_func("'nqn' not defined in subsystem %d" % index)
-                continue
-
-            Subsystem.setup(t, err_func)
+            Subsystem.setup(t, err_func, index)
 
         for index, t in enumerate(config.get('ports', [])):
-            if 'portid' not in t:
-                err_func("'portid' not defined in port %d" % index)
-                continue
-
-            Port.setup(self, t, err_func)
+            Port.setup(self, t, err_func, index)
 
         return errors
 
@@ -375,16 +578,21 @@ class Root(CFSNode):
         else:
             savefile = DEFAULT_SAVE_FILE
 
+        import json
+
         with open(savefile, "r") as f:
-            config = json.loads(f.read())
-            return self.restore(config, clear_existing=clear_existing,
-                                abort_on_error=abort_on_error)
+            config = json.load(f)
+        return self.restore(config, clear_existing=clear_existing,
+                            abort_on_error=abort_on_error)
 
     def dump(self):
         d = super(Root, self).dump()
-        d['subsystems'] = [s.dump() for s in self.subsystems]
-        d['ports'] = [p.dump() for p in self.ports]
-        d['hosts'] = [h.dump() for h in self.hosts]
+        d['subsystems'] = [s.dump() for s in
+                           sorted(self.subsystems, key=lambda s: s.nqn)]
+        d['ports'] = [p.dump() for p in
+                      sorted(self.ports, key=lambda p: p.portid)]
+        d['hosts'] = [h.dump() for h in
+                      sorted(self.hosts, key=lambda h: h.nqn)]
         return d
 
 
@@ -394,6 +602,8 @@ class Subsystem(CFSNode):
     A Subsystem is identified by its NQN.
     '''
 
+    __slots__ = ('nqn', '_namespaces_dir', '_allowed_hosts_dir')
+
     def __repr__(self):
         return "<Subsystem %s>" % self.nqn
 
@@ -420,12 +630,12 @@ class Subsystem(CFSNode):
         self.nqn = nqn
         self.attr_groups = ['attr']
         self._path = "%s/subsystems/%s" % (self.configfs_dir, nqn)
+        self._namespaces_dir = self._path + "/namespaces"
+        self._allowed_hosts_dir = self._path + "/allowed_hosts"
         self._create_in_cfs(mode)
 
     def _generate_nqn(self):
-        prefix = "nqn.2014-08.org.nvmexpress:NVMf:uuid"
-        name = str(uuid.uuid4())
-        return "%s:%s" % (prefix, name)
+        return GENERATED_NQN_PREFIX + str(uuid.uuid4())
 
     def delete(self):
         '''
@@ -440,17 +650,23 @@ class Subsystem(CFSNode):
             self.remove_allowed_host(h)
         super(Subsystem, self).delete()
 
-    def _list_namespaces(self):
+    def _list_nsids(self):
         self._check_self()
-        for d in os.listdir("%s/namespaces/" % self._path):
-            yield Namespace(self, int(d), 'lookup')
+        return [int(d) for d in os.listdir(self._namespaces_dir)]
+
+    nsids = property(_list_nsids,
+                     doc="Get the list of Namespace IDs for the Subsystem.")
+
+    def _list_namespaces(self):
+        for nsid in self.nsids:
+            yield Namespace(self, nsid, 'lookup_unchecked')
 
     namespaces = property(_list_namespaces,
                           doc="Get the list of Namespaces for the Subsystem.")
 
     def _list_allowed_hosts(self):
         return [os.path.basename(name)
-                for name in os.listdir("%s/allowed_hosts/" % self._path)]
+                for name in os.listdir(self._allowed_hosts_dir)]
 
     allowed_hosts = property(_list_allowed_hosts,
                              doc="Get the list of Allowed Hosts for the Subsystem.")
@@ -460,8 +676,8 @@ class Subsystem(CFSNode):
         Enable access for the host identified by I{nqn} to the Subsystem
         '''
         try:
-            os.symlink("%s/hosts/%s" % (self.configfs_dir, nqn),
-                       "%s/allowed_hosts/%s" % (self._path, nqn))
+            os.symlink(self.configfs_dir + "/hosts/" + nqn,
+                       self._allowed_hosts_dir + "/" + nqn)
         except Exception as e:
             raise CFSError("Could not symlink %s in configFS: %s" % (nqn, e))
 
@@ -470,20 +686,24 @@ class Subsystem(CFSNode):
         Disable access for the host identified by I{nqn} to the Subsystem
         '''
         try:
-            os.unlink("%s/allowed_hosts/%s" % (self._path, nqn))
+            os.unlink(self._allowed_hosts_dir + "/" + nqn)
         except Exception as e:
             raise CFSError("Could not unlink %s in configFS: %s" % (nqn, e))
 
     @classmethod
-    def setup(cls, t, err_func):
+    def setup(cls, t, err_func, index=None):
         '''
         Set up Subsystem objects based upon t dict, from saved config.
         Guard against missing or bad dict items, but keep going.
         Call 'err_func' for each error.
+        'index' is the position of t in the saved config, if known.
         '''
 
         if 'nqn' not in t:
-            err_func("'nqn' not defined for Subsystem")
+            if index is None:
+                err_func("'nqn' not defined for Subsystem")
+            else:
+                err_func("'nqn' not defined in subsystem %d" % index)
             return
 
         try:
@@ -502,8 +722,9 @@ class Subsystem(CFSNode):
     def dump(self):
         d = super(Subsystem, self).dump()
         d['nqn'] = self.nqn
-        d['namespaces'] = [ns.dump() for ns in self.namespaces]
-        d['allowed_hosts'] = self.allowed_hosts
+        d['namespaces'] = [ns.dump() for ns in
+                           sorted(self.namespaces, key=lambda ns: ns.nsid)]
+        d['allowed_hosts'] = sorted(self.allowed_hosts)
         return d
 
 
@@ -513,6 +734,8 @@ class Namespace(CFSNode):
     A Namespace is identified by its parent Subsystem and Namespace ID.
     '''
 
+    __slots__ = ('_subsystem', '_nsid')
+
     MAX_NSID = 8192
 
     def __repr__(self):
@@ -541,11 +764,9 @@ class Namespace(CFSNode):
             if mode == 'lookup':
                 raise CFSError("Need NSID for lookup")
 
-            nsids = [n.nsid for n in subsystem.namespaces]
-            for index in xrange(1, self.MAX_NSID + 1):
-                if index not in nsids:
-                    nsid = index
-                    break
+            used = set(subsystem.nsids)
+            nsid = next((index for index in range(1, self.MAX_NSID + 1)
+                         if index not in used), None)
             if nsid is None:
                 raise CFSError("All NSIDs 1-%d in use" % self.MAX_NSID)
         else:
@@ -600,6 +821,8 @@ class Port(CFSNode):
     This is an interface to a NVMe Port in configFS.
     '''
 
+    __slots__ = ('_portid', '_subsystems_dir', '_referrals_dir')
+
     MAX_PORTID = 8192
 
     def __repr__(self):
@@ -611,6 +834,8 @@ class Port(CFSNode):
         self.attr_groups = ['addr']
         self._portid = int(portid)
         self._path = "%s/ports/%d" % (self.configfs_dir, self._portid)
+        self._subsystems_dir = self._path + "/subsystems"
+        self._referrals_dir = self._path + "/referrals"
         self._create_in_cfs(mode)
 
     def _get_portid(self):
@@ -620,7 +845,7 @@ class Port(CFSNode):
 
     def _list_subsystems(self):
         return [os.path.basename(name)
-                for name in os.listdir("%s/subsystems/" % self._path)]
+                for name in os.listdir(self._subsystems_dir)]
 
     subsystems = property(_list_subsystems,
                           doc="Get the list of Subsystem for this Port.")
@@ -630,8 +855,8 @@ class Port(CFSNode):
         Enable access to the Subsystem identified by I{nqn} through this Port.
         '''
         try:
-            os.symlink("%s/subsystems/%s" % (self.configfs_dir, nqn),
-                       "%s/subsystems/%s" % (self._path, nqn))
+            os.symlink(self.configfs_dir + "/subsystems/" + nqn,
+                       self._subsystems_dir + "/" + nqn)
         except Exception as e:
             raise CFSError("Could not symlink %s in configFS: %s" % (nqn, e))
 
@@ -640,7 +865,7 @@ class Port(CFSNode):
         Disable access to the Subsystem identified by I{nqn} through this Port.
         '''
         try:
-            os.unlink("%s/subsystems/%s" % (self._path, nqn))
+            os.unlink(self._subsystems_dir + "/" + nqn)
         except Exception as e:
             raise CFSError("Could not unlink %s in configFS: %s" % (nqn, e))
 
@@ -655,24 +880,34 @@ class Port(CFSNode):
             r.delete()
         super(Port, self).delete()
 
-    def _list_referrals(self):
+    def _list_referral_names(self):
         self._check_self()
-        for d in os.listdir("%s/referrals/" % self._path):
-            yield Referral(self, d, 'lookup')
+        return os.listdir(self._referrals_dir)
+
+    referral_names = property(_list_referral_names,
+                              doc="Get the list of Referral names.")
+
+    def _list_referrals(self):
+        for name in self.referral_names:
+            yield Referral(self, name, 'lookup_unchecked')
 
     referrals = property(_list_referrals,
                          doc="Get the list of Referrals for this Port.")
 
     @classmethod
-    def setup(cls, root, n, err_func):
+    def setup(cls, root, n, err_func, index=None):
         '''
         Set up a Namespace object based upon n dict, from saved config.
         Guard against missing or bad dict items, but keep going.
         Call 'err_func' for each error.
+        'index' is the position of n in the saved config, if known.
         '''
 
         if 'portid' not in n:
-            err_func("'portid' not defined for Port")
+            if index is None:
+                err_func("'portid' not defined for Port")
+            else:
+                err_func("'portid' not defined in port %d" % index)
             return
 
         try:
@@ -690,8 +925,9 @@ class Port(CFSNode):
     def dump(self):
         d = super(Port, self).dump()
         d['portid'] = self.portid
-        d['subsystems'] = self.subsystems
-        d['referrals'] = [r.dump() for r in self.referrals]
+        d['subsystems'] = sorted(self.subsystems)
+        d['referrals'] = [r.dump() for r in
+                          sorted(self.referrals, key=lambda r: r.name)]
         return d
 
 
@@ -700,6 +936,8 @@ class Referral(CFSNode):
     This is an interface to a NVMe Referral in configFS.
     '''
 
+    __slots__ = ('port', '_name')
+
     def __repr__(self):
         return "<Referral %d>" % self.name
 
@@ -752,6 +990,8 @@ class Host(CFSNode):
     A Host is identified by its NQN.
     '''
 
+    __slots__ = ('nqn',)
+
     def __repr__(self):
         return "<Host %s>" % self.nqn
 
@@ -774,15 +1014,19 @@ class Host(CFSNode):
         self._create_in_cfs(mode)
 
     @classmethod
-    def setup(cls, t, err_func):
+    def setup(cls, t, err_func, index=None):
         '''
         Set up Host objects based upon t dict, from saved config.
         Guard against missing or bad dict items, but keep going.
         Call 'err_func' for each error.
+        'index' is the position of t in the saved config, if known.
         '''
 
         if 'nqn' not in t:
-            err_func("'nqn' not defined for Host")
+            if index is None:
+                err_func("'nqn' not defined for Host")
+            else:
+                err_func("'nqn' not defined in host %d" % index)
             return
 
         try:
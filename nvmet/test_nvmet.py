@@ -1,46 +1,77 @@
 
-import random
-import string
+import os
+import shutil
+import tempfile
 import unittest
 import nvmet.nvme as nvme
 
+# Address the loop ports and referrals in the tests are set up with
+LOOP_ADDR = {'trtype': 'loop', 'adrfam': 'ipv4', 'traddr': '192.168.0.1',
+             'treq': 'not required', 'trsvcid': '1023'}
+
+# Address changes that must be refused while the address is in use
+OTHER_ADDR = [('trtype', 'rdma'), ('adrfam', 'ipv6'),
+              ('traddr', '10.0.0.1'), ('treq', 'required'),
+              ('trsvcid', '21')]
+
 
 class TestNvmet(unittest.TestCase):
-    def test_subsystem(self):
-        root = nvme.Root()
+    @classmethod
+    def setUpClass(cls):
+        # Loads the nvmet module if needed; every test shares this Root.
+        cls.root = nvme.Root()
+        # Keep saved configs off the disk the tests are run from
+        shm = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        cls.tmpdir = tempfile.mkdtemp(dir=shm)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def _fresh_root(self, children=None):
+        '''
+        Clears the configuration and returns the shared Root.  If
+        I{children} names one of its listings, checks that it is empty.
+        '''
+        root = self.root
         root.clear_existing()
-        for s in root.subsystems:
-            self.assertTrue(False, 'Found Subsystem after clear')
+        if children is not None:
+            for child in getattr(root, children):
+                self.fail('Found %r after clear' % child)
+        return root
+
+    def test_subsystem(self):
+        root = self._fresh_root('subsystems')
 
         # create mode
         s1 = nvme.Subsystem(nqn='testnqn1', mode='create')
         self.assertIsNotNone(s1)
-        self.assertEqual(len(list(root.subsystems)), 1)
+        self.assertEqual(len(root.subsystem_nqns), 1)
 
         # any mode, should create
         s2 = nvme.Subsystem(nqn='testnqn2', mode='any')
         self.assertIsNotNone(s2)
-        self.assertEqual(len(list(root.subsystems)), 2)
+        self.assertEqual(len(root.subsystem_nqns), 2)
 
         # random name
         s3 = nvme.Subsystem(mode='create')
         self.assertIsNotNone(s3)
-        self.assertEqual(len(list(root.subsystems)), 3)
+        self.assertEqual(len(root.subsystem_nqns), 3)
 
         # duplicate
         self.assertRaises(nvme.CFSError, nvme.Subsystem,
                           nqn='testnqn1', mode='create')
-        self.assertEqual(len(list(root.subsystems)), 3)
+        self.assertEqual(len(root.subsystem_nqns), 3)
 
         # lookup using any, should not create
         s = nvme.Subsystem(nqn='testnqn1', mode='any')
         self.assertEqual(s1, s)
-        self.assertEqual(len(list(root.subsystems)), 3)
+        self.assertEqual(len(root.subsystem_nqns), 3)
 
         # lookup only
         s = nvme.Subsystem(nqn='testnqn2', mode='lookup')
         self.assertEqual(s2, s)
-        self.assertEqual(len(list(root.subsystems)), 3)
+        self.assertEqual(len(root.subsystem_nqns), 3)
 
         # lookup without nqn
         self.assertRaises(nvme.CFSError, nvme.Subsystem, mode='lookup')
@@ -48,50 +79,49 @@ class TestNvmet(unittest.TestCase):
         # and delete them all
         for s in root.subsystems:
             s.delete()
-        self.assertEqual(len(list(root.subsystems)), 0)
+        self.assertEqual(len(root.subsystem_nqns), 0)
 
     def test_namespace(self):
-        root = nvme.Root()
-        root.clear_existing()
+        self._fresh_root()
 
         s = nvme.Subsystem(nqn='testnqn', mode='create')
         for n in s.namespaces:
-            self.assertTrue(False, 'Found Namespace in new Subsystem')
+            self.fail('Found Namespace in new Subsystem')
 
         # create mode
         n1 = nvme.Namespace(s, nsid=3, mode='create')
         self.assertIsNotNone(n1)
-        self.assertEqual(len(list(s.namespaces)), 1)
+        self.assertEqual(len(s.nsids), 1)
 
         # any mode, should create
         n2 = nvme.Namespace(s, nsid=2, mode='any')
         self.assertIsNotNone(n2)
-        self.assertEqual(len(list(s.namespaces)), 2)
+        self.assertEqual(len(s.nsids), 2)
 
         # create without nsid, should pick lowest available
         n3 = nvme.Namespace(s, mode='create')
         self.assertIsNotNone(n3)
         self.assertEqual(n3.nsid, 1)
-        self.assertEqual(len(list(s.namespaces)), 3)
+        self.assertEqual(len(s.nsids), 3)
 
         n4 = nvme.Namespace(s, mode='create')
         self.assertIsNotNone(n4)
         self.assertEqual(n4.nsid, 4)
-        self.assertEqual(len(list(s.namespaces)), 4)
+        self.assertEqual(len(s.nsids), 4)
 
         # duplicate
         self.assertRaises(nvme.CFSError, nvme.Namespace, 1, mode='create')
-        self.assertEqual(len(list(s.namespaces)), 4)
+        self.assertEqual(len(s.nsids), 4)
 
         # lookup using any, should not create
         n = nvme.Namespace(s, nsid=3, mode='any')
         self.assertEqual(n1, n)
-        self.assertEqual(len(list(s.namespaces)), 4)
+        self.assertEqual(len(s.nsids), 4)
 
         # lookup only
         n = nvme.Namespace(s, nsid=2, mode='lookup')
         self.assertEqual(n2, n)
-        self.assertEqual(len(list(s.namespaces)), 4)
+        self.assertEqual(len(s.nsids), 4)
 
         # lookup without nsid
         self.assertRaises(nvme.CFSError, nvme.Namespace, None, mode='lookup')
@@ -99,11 +129,10 @@ class TestNvmet(unittest.TestCase):
         # and delete them all
         for n in s.namespaces:
             n.delete()
-        self.assertEqual(len(list(s.namespaces)), 0)
+        self.assertEqual(len(s.nsids), 0)
 
     def test_namespace_attrs(self):
-        root = nvme.Root()
-        root.clear_existing()
+        self._fresh_root()
 
         s = nvme.Subsystem(nqn='testnqn', mode='create')
         n = nvme.Namespace(s, mode='create')
@@ -132,61 +161,58 @@ class TestNvmet(unittest.TestCase):
         # disable: once and twice
         n.set_enable(0)
         n.set_enable(0)
+        self.assertEqual(n.get_enable(use_cache=True), 0)
+        self.assertFalse(n.get_enable())
 
         # enable again, and remove while enabled
         n.set_enable(1)
         n.delete()
 
     def test_recursive_delete(self):
-        root = nvme.Root()
-        root.clear_existing()
+        root = self._fresh_root()
 
         s = nvme.Subsystem(nqn='testnqn', mode='create')
         n1 = nvme.Namespace(s, mode='create')
         n2 = nvme.Namespace(s, mode='create')
 
         s.delete()
-        self.assertEqual(len(list(root.subsystems)), 0)
+        self.assertEqual(len(root.subsystem_nqns), 0)
 
     def test_port(self):
-        root = nvme.Root()
-        root.clear_existing()
-        for p in root.ports:
-            self.assertTrue(False, 'Found Port after clear')
+        root = self._fresh_root('ports')
 
         # create mode
         p1 = nvme.Port(portid=0, mode='create')
         self.assertIsNotNone(p1)
-        self.assertEqual(len(list(root.ports)), 1)
+        self.assertEqual(len(root.portids), 1)
 
         # any mode, should create
         p2 = nvme.Port(portid=1, mode='any')
         self.assertIsNotNone(p2)
-        self.assertEqual(len(list(root.ports)), 2)
+        self.assertEqual(len(root.portids), 2)
 
         # duplicate
         self.assertRaises(nvme.CFSError, nvme.Port,
                           portid=0, mode='create')
-        self.assertEqual(len(list(root.ports)), 2)
+        self.assertEqual(len(root.portids), 2)
 
         # lookup using any, should not create
         p = nvme.Port(portid=0, mode='any')
         self.assertEqual(p1, p)
-        self.assertEqual(len(list(root.ports)), 2)
+        self.assertEqual(len(root.portids), 2)
 
         # lookup only
         p = nvme.Port(portid=1, mode='lookup')
         self.assertEqual(p2, p)
-        self.assertEqual(len(list(root.ports)), 2)
+        self.assertEqual(len(root.portids), 2)
 
         # and delete them all
         for p in root.ports:
             p.delete()
-        self.assertEqual(len(list(root.ports)), 0)
+        self.assertEqual(len(root.portids), 0)
 
     def test_loop_port(self):
-        root = nvme.Root()
-        root.clear_existing()
+        self._fresh_root()
 
         s = nvme.Subsystem(nqn='testnqn', mode='create')
         p = nvme.Port(portid=0, mode='create')
@@ -200,111 +226,94 @@ class TestNvmet(unittest.TestCase):
         self.assertRaises(nvme.CFSError, p.add_subsystem, 'testnqn')
 
         # now set trtype to loop and other attrs and enable
-        p.set_attr('addr', 'trtype', 'loop')
-        p.set_attr('addr', 'adrfam', 'ipv4')
-        p.set_attr('addr', 'traddr', '192.168.0.1')
-        p.set_attr('addr', 'treq', 'not required')
-        p.set_attr('addr', 'trsvcid', '1023')
+        p.apply_attrs({'addr': LOOP_ADDR})
         p.add_subsystem('testnqn')
 
         # test double add
         self.assertRaises(nvme.CFSError, p.add_subsystem, 'testnqn')
 
         # test that we can't write to attrs while enabled
-        self.assertRaises(nvme.CFSError, p.set_attr, 'addr', 'trtype',
-                          'rdma')
-        self.assertRaises(nvme.CFSError, p.set_attr, 'addr', 'adrfam',
-                          'ipv6')
-        self.assertRaises(nvme.CFSError, p.set_attr, 'addr', 'traddr',
-                          '10.0.0.1')
-        self.assertRaises(nvme.CFSError, p.set_attr, 'addr', 'treq',
-                          'required')
-        self.assertRaises(nvme.CFSError, p.set_attr, 'addr', 'trsvcid',
-                          '21')
+        for name, value in OTHER_ADDR:
+            self.assertRaises(nvme.CFSError, p.set_attr, 'addr', name,
+                              value)
 
         # remove: once and twice
         p.remove_subsystem('testnqn')
         self.assertRaises(nvme.CFSError, p.remove_subsystem, 'testnqn')
 
         # check that the attrs haven't been tampered with
-        self.assertEqual(p.get_attr('addr', 'trtype'), 'loop')
-        self.assertEqual(p.get_attr('addr', 'adrfam'), 'ipv4')
-        self.assertEqual(p.get_attr('addr', 'traddr'), '192.168.0.1')
-        self.assertEqual(p.get_attr('addr', 'treq'), 'not required')
-        self.assertEqual(p.get_attr('addr', 'trsvcid'), '1023')
+        addr = p.get_attrs('addr')
+        self.assertEqual(dict((name, addr[name]) for name in LOOP_ADDR),
+                         LOOP_ADDR)
 
         # add again, and try to remove while enabled
         p.add_subsystem('testnqn')
         p.delete()
 
     def test_host(self):
-        root = nvme.Root()
-        root.clear_existing()
-        for p in root.hosts:
-            self.assertTrue(False, 'Found Host after clear')
+        root = self._fresh_root('hosts')
 
         # create mode
         h1 = nvme.Host(nqn='foo', mode='create')
         self.assertIsNotNone(h1)
-        self.assertEqual(len(list(root.hosts)), 1)
+        self.assertEqual(len(root.host_nqns), 1)
 
         # any mode, should create
         h2 = nvme.Host(nqn='bar', mode='any')
         self.assertIsNotNone(h2)
-        self.assertEqual(len(list(root.hosts)), 2)
+        self.assertEqual(len(root.host_nqns), 2)
 
         # duplicate
         self.assertRaises(nvme.CFSError, nvme.Host,
                           'foo', mode='create')
-        self.assertEqual(len(list(root.hosts)), 2)
+        self.assertEqual(len(root.host_nqns), 2)
 
         # lookup using any, should not create
         h = nvme.Host('foo', mode='any')
         self.assertEqual(h1, h)
-        self.assertEqual(len(list(root.hosts)), 2)
+        self.assertEqual(len(root.host_nqns), 2)
 
         # lookup only
         h = nvme.Host('bar', mode='lookup')
         self.assertEqual(h2, h)
-        self.assertEqual(len(list(root.hosts)), 2)
+        self.assertEqual(len(root.host_nqns), 2)
 
         # and delete them all
         for h in root.hosts:
             h.delete()
-        self.assertEqual(len(list(root.hosts)), 0)
+        self.assertEqual(len(root.host_nqns), 0)
 
     def test_referral(self):
-        root = nvme.Root()
-        root.clear_existing()
+        self._fresh_root()
 
         # create port
         p = nvme.Port(portid=1, mode='create')
-        self.assertEqual(len(list(p.referrals)), 0)
+        self.assertEqual(len(p.referral_names), 0)
 
         # create mode
         r1 = nvme.Referral(p, name="1", mode='create')
         self.assertIsNotNone(r1)
-        self.assertEqual(len(list(p.referrals)), 1)
+        self.assertEqual(len(p.referral_names), 1)
 
         # any mode, should create
         r2 = nvme.Referral(p, name="2", mode='any')
         self.assertIsNotNone(r2)
-        self.assertEqual(len(list(p.referrals)), 2)
+        self.assertEqual(len(p.referral_names), 2)
 
         # duplicate
         self.assertRaises(nvme.CFSError, nvme.Referral,
                           p, name="2", mode='create')
-        self.assertEqual(len(list(p.referrals)), 2)
+        self.assertEqual(len(p.referral_names), 2)
 
         # lookup using any, should not create
         r = nvme.Referral(p, name="1", mode='any')
         self.assertEqual(r1, r)
-        self.assertEqual(len(list(p.referrals)), 2)
+        self.assertEqual(len(p.referral_names), 2)
 
         # lookup only
         r = nvme.Referral(p, name="2", mode='lookup')
         self.assertEqual(r2, r)
-        self.assertEqual(len(list(p.referrals)), 2)
+        self.assertEqual(len(p.referral_names), 2)
 
         # non-existant lookup
         self.assertRaises(nvme.CFSError, nvme.Referral, p, name="foo",
@@ -315,38 +324,25 @@ class TestNvmet(unittest.TestCase):
         self.assertFalse(r.get_enable())
 
         # now set trtype to loop and other attrs and enable
-        r.set_attr('addr', 'trtype', 'loop')
-        r.set_attr('addr', 'adrfam', 'ipv4')
-        r.set_attr('addr', 'traddr', '192.168.0.1')
-        r.set_attr('addr', 'treq', 'not required')
-        r.set_attr('addr', 'trsvcid', '1023')
+        r.apply_attrs({'addr': LOOP_ADDR})
         r.set_enable(1)
 
         # test double enable
         r.set_enable(1)
 
         # test that we can't write to attrs while enabled
-        self.assertRaises(nvme.CFSError, r.set_attr, 'addr', 'trtype',
-                          'rdma')
-        self.assertRaises(nvme.CFSError, r.set_attr, 'addr', 'adrfam',
-                          'ipv6')
-        self.assertRaises(nvme.CFSError, r.set_attr, 'addr', 'traddr',
-                          '10.0.0.1')
-        self.assertRaises(nvme.CFSError, r.set_attr, 'addr', 'treq',
-                          'required')
-        self.assertRaises(nvme.CFSError, r.set_attr, 'addr', 'trsvcid',
-                          '21')
+        for name, value in OTHER_ADDR:
+            self.assertRaises(nvme.CFSError, r.set_attr, 'addr', name,
+                              value)
 
         # disable: once and twice
         r.set_enable(0)
         r.set_enable(0)
 
         # check that the attrs haven't been tampered with
-        self.assertEqual(r.get_attr('addr', 'trtype'), 'loop')
-        self.assertEqual(r.get_attr('addr', 'adrfam'), 'ipv4')
-        self.assertEqual(r.get_attr('addr', 'traddr'), '192.168.0.1')
-        self.assertEqual(r.get_attr('addr', 'treq'), 'not required')
-        self.assertEqual(r.get_attr('addr', 'trsvcid'), '1023')
+        addr = r.get_attrs('addr')
+        self.assertEqual(dict((name, addr[name]) for name in LOOP_ADDR),
+                         LOOP_ADDR)
 
         # enable again, and try to remove while enabled
         r.set_enable(1)
@@ -354,11 +350,9 @@ class TestNvmet(unittest.TestCase):
 
         # remove the other one while disabled:
         r1.delete()
-        self.assertEqual(len(list(p.referrals)), 0)
+        self.assertEqual(len(p.referral_names), 0)
 
     def test_allowed_hosts(self):
-        root = nvme.Root()
-
         h = nvme.Host(nqn='hostnqn', mode='create')
 
         s = nvme.Subsystem(nqn='testnqn', mode='create')
@@ -382,8 +376,7 @@ class TestNvmet(unittest.TestCase):
         self.assertRaises(nvme.CFSError, s.remove_allowed_host, 'foobar')
 
     def test_invalid_input(self):
-        root = nvme.Root()
-        root.clear_existing()
+        self._fresh_root()
 
         self.assertRaises(nvme.CFSError, nvme.Subsystem,
                           nqn='', mode='create')
@@ -391,8 +384,7 @@ class TestNvmet(unittest.TestCase):
                           nqn='/', mode='create')
 
         for l in [ 257, 512, 1024, 2048 ]:
-            toolong = ''.join(random.choice(string.lowercase)
-                              for i in range(l))
+            toolong = 'a' * l
             self.assertRaises(nvme.CFSError, nvme.Subsystem,
                               nqn=toolong, mode='create')
 
@@ -404,8 +396,7 @@ class TestNvmet(unittest.TestCase):
                           portid=1 << 17, mode='create')
 
     def test_save_restore(self):
-        root = nvme.Root()
-        root.clear_existing()
+        root = self._fresh_root()
 
         h = nvme.Host(nqn='hostnqn', mode='create')
 
@@ -422,24 +413,21 @@ class TestNvmet(unittest.TestCase):
         nguid = n.get_attr('device', 'nguid')
 
         p = nvme.Port(portid=66, mode='create')
-        p.set_attr('addr', 'trtype', 'loop')
-        p.set_attr('addr', 'adrfam', 'ipv4')
-        p.set_attr('addr', 'traddr', '192.168.0.1')
-        p.set_attr('addr', 'treq', 'not required')
-        p.set_attr('addr', 'trsvcid', '1023')
+        p.apply_attrs({'addr': LOOP_ADDR})
         p.add_subsystem('testnqn')
 
         # save, clear, and restore
-        root.save_to_file('test.json')
+        savefile = os.path.join(self.tmpdir, 'test.json')
+        root.save_to_file(savefile)
         root.clear_existing()
-        root.restore_from_file('test.json')
+        root.restore_from_file(savefile)
 
         # additional restores should fai
         self.assertRaises(nvme.CFSError, root.restore_from_file,
-                          'test.json', False)
+                          savefile, False)
 
         # ... unless forced!
-        root.restore_from_file('test.json', True)
+        root.restore_from_file(savefile, True)
 
         # rebuild our view of the world
         h = nvme.Host(nqn='hostnqn', mode='lookup')
@@ -454,13 +442,25 @@ class TestNvmet(unittest.TestCase):
 
         # and check everything is still the same
         self.assertTrue(n.get_enable())
-        self.assertEqual(n.get_attr('device', 'path'), '/dev/ram0')
-        self.assertEqual(n.get_attr('device', 'nguid'), nguid)
-
-        self.assertEqual(p.get_attr('addr', 'trtype'), 'loop')
-        self.assertEqual(p.get_attr('addr', 'adrfam'), 'ipv4')
-        self.assertEqual(p.get_attr('addr', 'traddr'), '192.168.0.1')
-        self.assertEqual(p.get_attr('addr', 'treq'), 'not required')
-        self.assertEqual(p.get_attr('addr', 'trsvcid'), '1023')
+        device = n.get_attrs('device')
+        self.assertEqual(device['path'], '/dev/ram0')
+        self.assertEqual(device['nguid'], nguid)
+
+        addr = p.get_attrs('addr')
+        self.assertEqual(dict((name, addr[name]) for name in LOOP_ADDR),
+                         LOOP_ADDR)
         self.assertIn('testnqn', p.subsystems)
         self.assertNotIn('testtnqn2', p.subsystems)
+
+    def test_dump_rereads(self):
+        root = self._fresh_root()
+
+        p = nvme.Port(portid=1, mode='create')
+        p.set_attr('addr', 'trsvcid', '1023')
+        self.assertIsInstance(p.get_attr('addr', 'trsvcid'), str)
+        self.assertEqual(root.dump()['ports'][0]['addr']['trsvcid'], '1023')
+
+        # changes made behind our back must show up in the next dump
+        with open(os.path.join(p.path, 'addr_trsvcid'), 'w') as f:
+            f.write('4420')
+        self.assertEqual(root.dump()['ports'][0]['addr']['trsvcid'], '4420')